@@ -4,6 +4,7 @@ from typing import List, Optional, Dict, Any
 from datetime import datetime
 import uuid
 import asyncio
+import httpx
 from ..services.sanity_service import sanity_service
 from ..services.skyflow_service import skyflow_service
 from ..services.agent_service import agent_service
@@ -20,6 +21,29 @@ def get_sio():
     except Exception:
         return None
 router = APIRouter()
+def _create_patients(sanity_docs):
+    if not sanity_docs:
+        return []
+    try:
+        return sanity_service.create_patients(sanity_docs)
+    except (ValueError, httpx.ConnectError, httpx.ConnectTimeout) as e:
+        # Nothing reached Sanity (missing config, unreachable host): every row failed.
+        return [e] * len(sanity_docs)
+    except httpx.HTTPStatusError as e:
+        # Only a mutate Sanity rejected outright is safe to retry per patient; anything
+        # else (timeouts, post-commit failures) may already have created the documents.
+        if not 400 <= e.response.status_code < 500:
+            raise HTTPException(status_code=500, detail=f"Batch create failed: {str(e)}")
+        print(f"Batch create rejected, creating patients one by one: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch create failed: {str(e)}")
+    results = []
+    for sanity_data in sanity_docs:
+        try:
+            results.append(sanity_service.create_patient(sanity_data))
+        except Exception as e:
+            results.append(e)
+    return results
 class LabResult(BaseModel):
     test_name: str
     value: str
@@ -265,25 +289,31 @@ async def batch_create_patients(data: Dict[str, List[Dict[str, Any]]]):
     patients_data = data.get("patients", [])
     created = []
     failed = 0
-    for patient_data in patients_data:
+    tokens_batch = skyflow_service.tokenize_many([
+        {
+            "name": patient_data.get("name"),
+            "ssn": patient_data.get("ssn"),
+            "dob": patient_data.get("dob"),
+        }
+        for patient_data in patients_data
+    ])
+    sanity_docs = [
+        {
+            "name_token": tokens.get("name_token", f"sky_n_{uuid.uuid4().hex[:6]}"),
+            "ssn_token": tokens.get("ssn_token", f"sky_s_{uuid.uuid4().hex[:6]}"),
+            "dob_token": tokens.get("dob_token", f"sky_d_{uuid.uuid4().hex[:6]}"),
+            "condition": patient_data.get("condition", ""),
+            "department": patient_data.get("department", "General"),
+            "priority": patient_data.get("priority", "NORMAL"),
+            "assigned_doctor": patient_data.get("assigned_doctor", "Unassigned"),
+            "processed": False
+        }
+        for patient_data, tokens in zip(patients_data, tokens_batch)
+    ]
+    for sanity_data, result in zip(sanity_docs, _create_patients(sanity_docs)):
         try:
-            pii_data = {
-                "name": patient_data.get("name"),
-                "ssn": patient_data.get("ssn"),
-                "dob": patient_data.get("dob"),
-            }
-            tokens = skyflow_service.tokenize(pii_data)
-            sanity_data = {
-                "name_token": tokens.get("name_token", f"sky_n_{uuid.uuid4().hex[:6]}"),
-                "ssn_token": tokens.get("ssn_token", f"sky_s_{uuid.uuid4().hex[:6]}"),
-                "dob_token": tokens.get("dob_token", f"sky_d_{uuid.uuid4().hex[:6]}"),
-                "condition": patient_data.get("condition", ""),
-                "department": patient_data.get("department", "General"),
-                "priority": patient_data.get("priority", "NORMAL"),
-                "assigned_doctor": patient_data.get("assigned_doctor", "Unassigned"),
-                "processed": False
-            }
-            result = sanity_service.create_patient(sanity_data)
+            if isinstance(result, Exception):
+                raise result
             created.append(result.get("id"))
             process_patient_task.delay(result.get("id"), sanity_data)
         except Exception as e:
@@ -305,13 +335,14 @@ async def batch_upload(file: UploadFile = File(...)):
     created = []
     failed = 0
     errors = []
+    valid_rows = []
     for row_num, row in enumerate(rows, start=2):  
         try:
             if not row.get("name") or not row.get("ssn"):
                 failed += 1
                 errors.append(f"Row {row_num}: Missing required fields (name, ssn)")
                 continue
-            patient_data = PatientCreate(
+            valid_rows.append((row_num, PatientCreate(
                 name=row["name"],
                 ssn=row["ssn"],
                 dob=row.get("dob", ""),
@@ -320,26 +351,39 @@ async def batch_upload(file: UploadFile = File(...)):
                 department=row.get("department", "General"),
                 priority=row.get("priority", "NORMAL"),
                 assigned_doctor=row.get("assigned_doctor", "Unassigned")
-            )
-            tokens = skyflow_service.tokenize({
-                "name": patient_data.name,
-                "ssn": patient_data.ssn,
-                "dob": patient_data.dob or None,
-                "address": patient_data.address or None
-            })
-            sanity_data = {
-                "name_token": tokens.get("name_token", ""),
-                "ssn_token": tokens.get("ssn_token", ""),
-                "dob_token": tokens.get("dob_token", ""),
-                "address_token": tokens.get("address_token", ""),
-                "condition": patient_data.condition,
-                "department": patient_data.department,
-                "priority": patient_data.priority,
-                "assigned_doctor": patient_data.assigned_doctor,
-                "processed": False,
-                "source": "batch_upload"
-            }
-            result = sanity_service.create_patient(sanity_data)
+            )))
+        except Exception as e:
+            failed += 1
+            errors.append(f"Row {row_num}: {str(e)}")
+            print(f"Batch upload error at row {row_num}: {e}")
+    tokens_batch = skyflow_service.tokenize_many([
+        {
+            "name": patient_data.name,
+            "ssn": patient_data.ssn,
+            "dob": patient_data.dob or None,
+            "address": patient_data.address or None
+        }
+        for _, patient_data in valid_rows
+    ])
+    sanity_docs = [
+        {
+            "name_token": tokens.get("name_token", ""),
+            "ssn_token": tokens.get("ssn_token", ""),
+            "dob_token": tokens.get("dob_token", ""),
+            "address_token": tokens.get("address_token", ""),
+            "condition": patient_data.condition,
+            "department": patient_data.department,
+            "priority": patient_data.priority,
+            "assigned_doctor": patient_data.assigned_doctor,
+            "processed": False,
+            "source": "batch_upload"
+        }
+        for (_, patient_data), tokens in zip(valid_rows, tokens_batch)
+    ]
+    for (row_num, _), sanity_data, result in zip(valid_rows, sanity_docs, _create_patients(sanity_docs)):
+        try:
+            if isinstance(result, Exception):
+                raise result
             patient_id = result.get("id")
             created.append(patient_id)
             if CELERY_AVAILABLE and process_patient_task:
@@ -369,7 +413,7 @@ async def upload_document(file: UploadFile = File(...)):
     try:
         content = await file.read()
         text = content.decode('utf-8')
-        detect_result = skyflow_service.detect_pii(text)
+        detect_result = await skyflow_service.adetect_pii(text)
         tokens = skyflow_service.auto_tokenize_detected(detect_result)
         condition = "Unknown"
         if "diabetes" in text.lower():
@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import socketio
 from .config import settings
+from .services.sanity_service import sanity_service
+from .services.skyflow_service import skyflow_service
 app = FastAPI(title="VaultMind Pro API")
 app.add_middleware(
     CORSMiddleware,
@@ -22,4 +24,9 @@ async def root():
     return {"message": "VaultMind Pro API is running"}
 @fastapi_app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+@fastapi_app.on_event("shutdown")
+async def shutdown():
+    sanity_service.close()
+    skyflow_service.close()
+    await skyflow_service.aclose()
\ No newline at end of file
@@ -58,7 +58,7 @@ class AgentService:
         }
         print(f"Invoking Skyflow Function {settings.SKYFLOW_FUNCTION_ID}...")
         try:
-            result = skyflow_service.invoke_function(settings.SKYFLOW_FUNCTION_ID, payload)
+            result = await skyflow_service.ainvoke_function(settings.SKYFLOW_FUNCTION_ID, payload)
         except Exception as e:
             print(f"⚠️ Skyflow Function invocation failed: {e}")
             result = {"success": False, "error": str(e)}
@@ -87,7 +87,7 @@ Format: Provide a concise clinical summary (3-5 sentences) focusing on the most
                     name = patient_data.get('name', 'Unknown')
                     if name == 'Unknown' and patient_data.get('name_token'):
                         try:
-                            name = skyflow_service.detokenize(patient_data['name_token'])
+                            name = await skyflow_service.adetokenize(patient_data['name_token'])
                             print(f"✅ Detokenized name: {name[:20]}...")
                         except Exception as detokenize_error:
                             print(f"⚠️ Could not detokenize name: {detokenize_error}")
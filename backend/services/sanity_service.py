@@ -1,5 +1,8 @@
-import requests
+import httpx
+import orjson
 from ..config import settings
+import os
+import threading
 import uuid
 from datetime import datetime
 from typing import Dict, Any, List, Optional
@@ -10,12 +13,47 @@ class SanityService:
         self.token = settings.SANITY_API_TOKEN
         self.base_url = f"https://{self.project_id}.api.sanity.io/v2021-06-07/data/mutate/{self.dataset}"
         self.query_url = f"https://{self.project_id}.api.sanity.io/v2021-06-07/data/query/{self.dataset}"
+        self._client_instance = None
+        self._client_lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_client)
+    @property
+    def _client(self) -> httpx.Client:
+        client = self._client_instance
+        if client is None:
+            with self._client_lock:
+                client = self._client_instance
+                if client is None:
+                    client = httpx.Client(
+                        http2=True,
+                        timeout=30,
+                        limits=httpx.Limits(max_keepalive_connections=20),
+                        headers={
+                            "Authorization": f"Bearer {self.token}",
+                            "Content-Type": "application/json"
+                        }
+                    )
+                    self._client_instance = client
+        return client
+    def _reset_client(self):
+        # The parent's pooled sockets must not be reused (or closed) in a forked worker.
+        self._client_lock = threading.Lock()
+        self._client_instance = None
+    def close(self):
+        with self._client_lock:
+            client, self._client_instance = self._client_instance, None
+        if client is not None:
+            client.close()
     def create_patient(self, patient_data: dict):
+        return self.create_patients([patient_data])[0]
+    def create_patients(self, patients_data: List[dict]) -> List[Dict[str, Any]]:
+        if not patients_data:
+            return []
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
         if not self.token or self.token == "placeholder":
             raise ValueError("Sanity API Token not configured. Set SANITY_API_TOKEN in .env")
-        unique_id = str(uuid.uuid4())
+        unique_ids = [uuid.uuid4().hex for _ in patients_data]
         mutations = {
             "mutations": [
                 {
@@ -26,25 +64,41 @@ class SanityService:
                         "processed": False
                     }
                 }
+                for unique_id, patient_data in zip(unique_ids, patients_data)
             ]
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(self.base_url, json=mutations, headers=headers)
+        response = self._client.post(self.base_url, params={"returnIds": "true"}, content=orjson.dumps(mutations))
         response.raise_for_status()
-        result = response.json()
-        query = f'*[_type == "patient" && patientId == "{unique_id}"][0]'
-        query_response = requests.get(
-            self.query_url,
-            params={"query": query},
-            headers=headers
-        )
-        query_response.raise_for_status()
-        query_result = query_response.json().get("result")
-        if query_result and "_id" in query_result:
-            sanity_id = query_result["_id"]
-            return {"id": sanity_id, "_id": sanity_id, "patientId": unique_id, **patient_data}
-        else:
-            raise ValueError(f"Failed to retrieve created patient document")
+        try:
+            results = orjson.loads(response.content).get("results") or []
+        except (orjson.JSONDecodeError, AttributeError):
+            results = []  # The mutate committed; resolve the ids below instead of failing like a rejection
+        sanity_ids = [r.get("id") for r in results]
+        if len(sanity_ids) != len(unique_ids) or not all(sanity_ids):
+            # Older API responses may omit ids; resolve them with one query for the whole batch.
+            # The mutate has already committed, so failures here must not look like a rejected batch.
+            try:
+                query_response = self._client.get(
+                    self.query_url,
+                    params={
+                        "query": '*[_type == "patient" && patientId in $ids]{_id, patientId}',
+                        "$ids": orjson.dumps(unique_ids).decode()
+                    }
+                )
+                query_response.raise_for_status()
+                by_patient_id = {
+                    doc["patientId"]: doc["_id"]
+                    for doc in orjson.loads(query_response.content).get("result") or []
+                }
+            except (httpx.HTTPError, orjson.JSONDecodeError, AttributeError, KeyError, TypeError) as e:
+                raise RuntimeError(f"Created patients but failed to resolve their ids: {e}") from e
+            sanity_ids = [by_patient_id.get(unique_id) for unique_id in unique_ids]
+            if not all(sanity_ids):
+                raise RuntimeError(f"Failed to retrieve created patient document")
+        return [
+            {"id": sanity_id, "_id": sanity_id, "patientId": unique_id, **patient_data}
+            for sanity_id, unique_id, patient_data in zip(sanity_ids, unique_ids, patients_data)
+        ]
     def update_patient(self, patient_id: str, updates: dict):
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
@@ -60,10 +114,9 @@ class SanityService:
                 }
             ]
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(self.base_url, json=mutations, headers=headers)
+        response = self._client.post(self.base_url, content=orjson.dumps(mutations))
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     def get_patients(self):
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
@@ -71,10 +124,9 @@ class SanityService:
             raise ValueError("Sanity API Token not configured. Set SANITY_API_TOKEN in .env")
         query = '*[_type == "patient"] | order(_createdAt desc)'
         params = {"query": query}
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(self.query_url, params=params, headers=headers)
+        response = self._client.get(self.query_url, params=params)
         response.raise_for_status()
-        return response.json().get("result", [])
+        return orjson.loads(response.content).get("result", [])
     def create_document(self, doc_type: str, document_data: dict) -> Dict[str, Any]:
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
@@ -90,14 +142,13 @@ class SanityService:
                 }
             ]
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(self.base_url, json=mutations, headers=headers)
+        response = self._client.post(self.base_url, content=orjson.dumps(mutations))
         response.raise_for_status()
-        result = response.json()
+        result = orjson.loads(response.content)
         if "results" in result and len(result["results"]) > 0:
-            doc_id = result["results"][0].get("id", str(uuid.uuid4()))
+            doc_id = result["results"][0].get("id") or uuid.uuid4().hex
         else:
-            doc_id = str(uuid.uuid4())
+            doc_id = uuid.uuid4().hex
         return {
             "_id": doc_id,
             "_type": doc_type,
@@ -118,20 +169,18 @@ class SanityService:
                 }
             ]
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(self.base_url, json=mutations, headers=headers)
+        response = self._client.post(self.base_url, content=orjson.dumps(mutations))
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     def query(self, groq_query: str) -> List[Dict[str, Any]]:
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
         if not self.token or self.token == "placeholder":
             raise ValueError("Sanity API Token not configured. Set SANITY_API_TOKEN in .env")
         params = {"query": groq_query}
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(self.query_url, params=params, headers=headers)
+        response = self._client.get(self.query_url, params=params)
         response.raise_for_status()
-        result = response.json().get("result", [])
+        result = orjson.loads(response.content).get("result", [])
         if isinstance(result, dict):
             return result
         return result
@@ -142,13 +191,13 @@ class SanityService:
             raise ValueError("Sanity API Token not configured. Set SANITY_API_TOKEN in .env")
         query = f'*[_type == "patient" && _id == "{patient_id}"][0]'
         params = {"query": query}
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(self.query_url, params=params, headers=headers)
+        response = self._client.get(self.query_url, params=params)
         if response.status_code == 404:
             return None
         response.raise_for_status()
-        result = response.json().get("result")
-        return result
+        if b'"result":null' in response.content:
+            return None
+        return orjson.loads(response.content).get("result")
     def delete_all_patients(self):
         if settings.SANITY_PROJECT_ID == "placeholder" or not self.project_id:
             raise ValueError("Sanity Project ID not configured. Set SANITY_PROJECT_ID in .env")
@@ -156,10 +205,9 @@ class SanityService:
             raise ValueError("Sanity API Token not configured. Set SANITY_API_TOKEN in .env")
         query = '*[_type == "patient"]._id'
         params = {"query": query}
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.get(self.query_url, params=params, headers=headers)
+        response = self._client.get(self.query_url, params=params)
         response.raise_for_status()
-        ids = response.json().get("result", [])
+        ids = orjson.loads(response.content).get("result", [])
         if not ids:
             return
         mutations = {
@@ -167,6 +215,6 @@ class SanityService:
                 {"delete": {"id": doc_id}} for doc_id in ids
             ]
         }
-        response = requests.post(self.base_url, json=mutations, headers=headers)
+        response = self._client.post(self.base_url, content=orjson.dumps(mutations))
         response.raise_for_status()
 sanity_service = SanityService()
\ No newline at end of file
@@ -1,247 +1,556 @@
 from ..config import settings
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
 import uuid
+import asyncio
+import httpx
 import requests
-import json
-from typing import Dict, List, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+logger = logging.getLogger(__name__)
+DETOKENIZE_CACHE_MAX_SIZE = 1024
+DETOKENIZE_CACHE_TTL_SECONDS = 300
+DETECT_CACHE_MAX_SIZE = 128
+DETECT_CACHE_TTL_SECONDS = 600
+_ENTITY_COLUMNS = MappingProxyType({
+    "SSN": "ssn",
+    "EMAIL": "email_address",
+    "DOB": "date_of_birth",
+    "NAME": "name"
+})
+_FIELD_MAPPING = MappingProxyType({
+    "name": "name",
+    "ssn": "ssn",
+    "dob": "date_of_birth",
+    "address": "state",
+    "email": "email_address"
+})
+_TYPE_TO_PREFIX = MappingProxyType({
+    "SSN": "ssn",
+    "EMAIL": "email",
+    "DOB": "dob",
+    "NAME": "name"
+})
+# One alternation so the text is scanned once; the NAME branch matches
+# "Name: Value", "Patient: Value" or "Patient Name: Value".
+_PII_RE = re.compile(
+    r'(?P<SSN>\b\d{3}-\d{2}-\d{4}\b)'
+    r'|(?P<EMAIL>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b)'
+    r'|(?P<DOB>\b(?:\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})\b)'
+    r'|(?i:Name|Patient|Patient Name):\s*(?P<NAME>[A-Za-z\s]+)(?:\n|$)',
+    re.ASCII
+)
+# RE2 scans the same pattern as a DFA without backtracking, which matters
+# on long clinical notes; its \b, \d and \s are ASCII-only like re.ASCII.
+try:
+    import re2
+    _PII_SCANNER = re2.compile(_PII_RE.pattern)
+except Exception:
+    _PII_SCANNER = _PII_RE
+_PII_GROUPS = _PII_RE.groupindex
+def _looks_like_skyflow_id(value: str) -> bool:
+    if len(value) != 36 or value[8] != "-" or value[13] != "-" or value[18] != "-" or value[23] != "-":
+        return False
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+def _normalize_dob(value):
+    # MM/DD/YYYY -> YYYY-MM-DD; the fixed-width shapes are by far the common case.
+    s = value if isinstance(value, str) else str(value)
+    if len(s) == 10:
+        if s[2] == "/" and s[5] == "/":
+            return s[6:10] + "-" + s[0:2] + "-" + s[3:5]
+        if s[4] == "-" and s[7] == "-":
+            return value
+    month, sep, rest = s.partition("/")
+    if sep:
+        day, sep, year = rest.partition("/")
+        if sep and "/" not in year:
+            return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    return value
+@dataclass(slots=True)
+class _PIIEntity:
+    type: str
+    value: str
+    confidence: float
+    start_pos: int
+    end_pos: int
+    token: Optional[str] = None
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "value": self.value,
+            "confidence": self.confidence,
+            "start_pos": self.start_pos,
+            "end_pos": self.end_pos,
+            "token": self.token
+        }
+class _TTLCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_at, value = entry
+            if time.monotonic() - cached_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+# Mock tokens stay base64 so a token written by one process (API, Celery
+# worker) still decodes in another; the memo only skips repeat work here.
+@lru_cache(maxsize=4096)
+def _mock_token(value: str, field_type: str) -> str:
+    encoded = base64.b64encode(value.encode()).decode()
+    return f"mock_{field_type}_{encoded}"
+@lru_cache(maxsize=4096)
+def _mock_value(token: str) -> str:
+    try:
+        parts = token.split("_")
+        if len(parts) >= 3:
+            return base64.b64decode(parts[-1]).decode()
+    except Exception:
+        pass
+    return token
+def _split_token(token: str):
+    # "<skyflow_id>#<column>" tokens point at one column of a vault record.
+    if "#" in token:
+        parts = token.split("#")
+        if len(parts) == 2:
+            return parts[0], parts[1]
+    return token, None
+def _record_value(result: dict, target_field: Optional[str]) -> Optional[str]:
+    records = result.get("records")
+    if not records:
+        return None
+    fields = records[0].get("fields", {})
+    if target_field:
+        value = fields.get(target_field)
+        if value:
+            return str(value)
+    for field_value in fields.values():
+        if field_value:
+            return str(field_value)
+    return None
+def _detokenized_value(result: dict) -> str:
+    if "records" in result and len(result["records"]) > 0:
+        return result["records"][0].get("value", "Unknown")
+    return "Unknown"
+def _entity_fields(entities: List[_PIIEntity]):
+    columns = [_ENTITY_COLUMNS[entity.type] for entity in entities]
+    return columns, [{column: entity.value} for column, entity in zip(columns, entities)]
+def _detect_cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+def _copy_detect_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    # Cached detections are shared; callers get their own dicts so edits can't leak into later hits.
+    return {**result, "entities": [dict(entity) for entity in result.get("entities", [])]}
+def _rejected_batch_status(exc: Exception) -> Optional[int]:
+    response = getattr(exc.__cause__, "response", None)
+    if response is None or response.status_code not in (400, 422):
+        return None
+    return response.status_code
+def _function_result(result):
+    if isinstance(result, dict):
+        if "result" in result:
+            return result["result"]
+        if "body" in result:
+            return result["body"]
+    return result
 class SkyflowService:
     def __init__(self):
         self.vault_id = settings.SKYFLOW_VAULT_ID
         self.vault_url = settings.SKYFLOW_VAULT_URL
-        self._bearer_token = settings.SKYFLOW_BEARER_TOKEN
+        self._session_instance = None
+        self._session_lock = threading.Lock()
+        # One async client per event loop; aclose() closes each on its own loop.
+        self._aclients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._detokenize_cache = _TTLCache(DETOKENIZE_CACHE_MAX_SIZE, DETOKENIZE_CACHE_TTL_SECONDS)
+        self._detect_cache = _TTLCache(DETECT_CACHE_MAX_SIZE, DETECT_CACHE_TTL_SECONDS)
+        self.refresh_token()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_session)
     @property
-    def bearer_token(self):
-        token = self._bearer_token or settings.SKYFLOW_BEARER_TOKEN
-        if not token or token == "placeholder":
-            raise ValueError("Skyflow Bearer Token not configured. Run: python3 generate_skyflow_token.py")
-        return token
+    def _session(self) -> requests.Session:
+        session = self._session_instance
+        if session is None:
+            with self._session_lock:
+                session = self._session_instance
+                if session is None:
+                    session = requests.Session()
+                    retry = Retry(
+                        total=3,
+                        backoff_factor=0.3,
+                        status_forcelist=[429, 502, 503, 504],
+                        raise_on_status=False
+                    )
+                    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update({
+                        "Authorization": f"Bearer {self.bearer_token}",
+                        "Content-Type": "application/json",
+                        "Accept": "application/json"
+                    })
+                    self._session_instance = session
+        return session
+    @property
+    def _aclient(self) -> httpx.AsyncClient:
+        # Pooled HTTP/2 connections belong to the event loop that opened them.
+        loop = asyncio.get_running_loop()
+        client = self._aclients.get(loop)
+        if client is None:
+            with self._session_lock:
+                client = self._aclients.get(loop)
+                if client is None:
+                    client = httpx.AsyncClient(
+                        http2=True,
+                        timeout=30,
+                        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+                        headers={
+                            "Authorization": f"Bearer {self.bearer_token}",
+                            "Content-Type": "application/json",
+                            "Accept": "application/json"
+                        }
+                    )
+                    # Clients of closed loops can't be used or awaited any more; live loops keep theirs until aclose().
+                    self._take_aclients(lambda other: other.is_closed())
+                    self._aclients[loop] = client
+        return client
+    def _take_aclients(self, predicate):
+        taken = [(loop, client) for loop, client in self._aclients.items() if predicate(loop)]
+        for loop, _ in taken:
+            del self._aclients[loop]
+        return taken
+    def _reset_session(self):
+        # The parent's pooled sockets must not be reused (or closed) in a forked worker.
+        self._session_lock = threading.Lock()
+        self._session_instance = None
+        self._aclients = {}
+    def close(self):
+        with self._session_lock:
+            session, self._session_instance = self._session_instance, None
+        if session is not None:
+            session.close()
+    async def aclose(self):
+        current = asyncio.get_running_loop()
+        with self._session_lock:
+            clients = self._take_aclients(lambda loop: True)
+        for loop, client in clients:
+            if loop is current:
+                await client.aclose()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), loop))
+            elif not loop.is_closed():
+                # An idle loop can be driven from a worker thread just long enough to close its client.
+                await asyncio.to_thread(loop.run_until_complete, client.aclose())
+    def refresh_token(self, token: Optional[str] = None):
+        previous_token = getattr(self, "bearer_token", None)
+        self.bearer_token = token or settings.SKYFLOW_BEARER_TOKEN
+        if self.bearer_token != previous_token:
+            # Cached plaintext was authorised for the old credentials; make the vault check the new ones.
+            self._detokenize_cache.clear()
+        # Validate once here instead of on every vault call.
+        if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
+            self._config_error = "Skyflow Vault ID not configured"
+        elif not self.bearer_token or self.bearer_token == "placeholder":
+            self._config_error = "Skyflow Bearer Token not configured. Run: python3 generate_skyflow_token.py"
+        else:
+            self._config_error = None
+        if self._session_instance is not None:
+            self._session_instance.headers["Authorization"] = f"Bearer {self.bearer_token}"
+        for client in list(self._aclients.values()):
+            client.headers["Authorization"] = f"Bearer {self.bearer_token}"
+    def _ensure_configured(self):
+        if self._config_error:
+            raise ValueError(self._config_error)
     def _mock_tokenize(self, value: str, field_type: str) -> str:
-        import base64
         if not value:
             return ""
-        encoded = base64.b64encode(str(value).encode()).decode()
-        return f"mock_{field_type}_{encoded}"
+        return _mock_token(str(value), field_type)
     def _mock_detokenize(self, token: str) -> str:
-        import base64
         if not token or not token.startswith("mock_"):
             return token
-        try:
-            parts = token.split("_")
-            if len(parts) >= 3:
-                encoded = parts[-1]
-                return base64.b64decode(encoded).decode()
-        except Exception:
-            pass
-        return token
+        return _mock_value(token)
     def tokenize(self, data: dict) -> dict:
-        pii_fields = {}
-        non_pii_data = {}
-        field_mapping = {
-            "name": "name",
-            "ssn": "ssn",
-            "dob": "date_of_birth",
-            "address": "state",
-            "email": "email_address"
-        }
-        for key, value in data.items():
-            if key in field_mapping:
-                pii_fields[field_mapping[key]] = value
-            else:
-                non_pii_data[key] = value
-        if not pii_fields:
+        pii_keys = [key for key in _FIELD_MAPPING if key in data]
+        if not pii_keys:
             return data
+        pii_fields = {_FIELD_MAPPING[key]: data[key] for key in pii_keys}
         try:
-            if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
-                raise ValueError("Skyflow Vault ID not configured")
-            if not self.bearer_token or self.bearer_token == "placeholder":
-                raise ValueError("Skyflow Bearer Token not configured")
-            print(f"Skyflow: Tokenizing {list(pii_fields.keys())}...")
+            logger.debug("Skyflow: Tokenizing %s...", list(pii_fields))
             result = self.insert_record("persons", pii_fields)
-            skyflow_record = result['records'][0]
-            skyflow_id = skyflow_record.get("skyflow_id")
-            tokenized_data = non_pii_data.copy()
-            returned_fields = skyflow_record.get("fields", {})
-            for key, col_name in field_mapping.items():
-                if key in data:
-                    token = returned_fields.get(col_name)
-                    if not token:
-                        token = f"{skyflow_id}#{col_name}"
-                    tokenized_data[f"{key}_token"] = token
-            return tokenized_data
+            return self._tokenized_from_record(data, pii_keys, result['records'][0])
+        except Exception as e:
+            logger.warning("Skyflow tokenization failed, falling back to local mock tokenization: %s", e)
+            return self._mock_tokenized(data, pii_keys)
+    def tokenize_many(self, items: List[dict]) -> List[dict]:
+        results = list(items)
+        pending = []
+        for index, data in enumerate(items):
+            pii_keys = [key for key in _FIELD_MAPPING if key in data]
+            if pii_keys:
+                pending.append((index, pii_keys))
+        if not pending:
+            return results
+        fields = [{_FIELD_MAPPING[key]: items[index][key] for key in pii_keys} for index, pii_keys in pending]
+        try:
+            # One vault round trip for the whole batch; tokens come back in record order.
+            logger.debug("Skyflow: Tokenizing %d records...", len(fields))
+            records = self.insert_records("persons", fields).get("records", [])
         except Exception as e:
-            print(f"⚠️ Skyflow tokenization failed: {e}")
-            print("🔄 Falling back to local mock tokenization...")
-            tokenized_data = non_pii_data.copy()
-            for key, value in data.items():
-                if key in field_mapping:
-                    token = self._mock_tokenize(value, key)
-                    tokenized_data[f"{key}_token"] = token
-            return tokenized_data
+            status = _rejected_batch_status(e)
+            if status is None:
+                # Not configured, unreachable, or a failure that may already have committed:
+                # re-inserting row by row would only repeat it (or duplicate the PII).
+                logger.warning("Skyflow bulk tokenization failed, falling back to local mock tokenization: %s", e)
+                records = []
+            else:
+                # A single rejected value fails the whole batch, so retry each record on its own.
+                logger.warning("Bulk insert rejected (%s), tokenizing records individually", status)
+                for index, _ in pending:
+                    results[index] = self.tokenize(items[index])
+                return results
+        for position, (index, pii_keys) in enumerate(pending):
+            if position < len(records):
+                results[index] = self._tokenized_from_record(items[index], pii_keys, records[position])
+            else:
+                results[index] = self._mock_tokenized(items[index], pii_keys)
+        return results
+    def _mock_tokenized(self, data: dict, pii_keys: List[str]) -> dict:
+        tokenized_data = {key: value for key, value in data.items() if key not in _FIELD_MAPPING}
+        for key in pii_keys:
+            tokenized_data[f"{key}_token"] = self._mock_tokenize(data[key], key)
+        return tokenized_data
+    def _tokenized_from_record(self, data: dict, pii_keys: List[str], record: dict) -> dict:
+        skyflow_id = record.get("skyflow_id")
+        returned_fields = record.get("fields", {})
+        tokenized_data = {key: value for key, value in data.items() if key not in _FIELD_MAPPING}
+        for key in pii_keys:
+            col_name = _FIELD_MAPPING[key]
+            tokenized_data[f"{key}_token"] = returned_fields.get(col_name) or f"{skyflow_id}#{col_name}"
+        return tokenized_data
     def insert_record(self, table: str, fields: dict) -> dict:
-        if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
-            raise ValueError("Skyflow Vault ID not configured")
-        if not self.bearer_token or self.bearer_token == "placeholder":
-            raise ValueError("Skyflow Bearer Token not configured")
-        formatted_fields = fields.copy()
-        if "date_of_birth" in formatted_fields:
-            dob_value = formatted_fields["date_of_birth"]
-            if "/" in str(dob_value):
-                parts = str(dob_value).split("/")
-                if len(parts) == 3:
-                    formatted_fields["date_of_birth"] = f"{parts[2]}-{parts[0].zfill(2)}-{parts[1].zfill(2)}"
+        return self.insert_records(table, [fields])
+    def insert_records(self, table: str, records: List[dict]) -> dict:
+        self._ensure_configured()
+        url, body = self._insert_request(table, records)
+        try:
+            response = self._session.post(url, data=body, timeout=30)
+            response.raise_for_status()
+            return orjson.loads(response.content)
+        except requests.exceptions.RequestException as e:
+            logger.error("Skyflow Insert Record API Error: %s", e)
+            raise Exception(f"Failed to insert record into Skyflow: {e}") from e
+    def _insert_request(self, table: str, records: List[dict]):
+        formatted_records = []
+        for fields in records:
+            # Only copy when there is something to rewrite; the caller's dict is never mutated.
+            if "date_of_birth" in fields:
+                fields = {**fields, "date_of_birth": _normalize_dob(fields["date_of_birth"])}
+            formatted_records.append({"fields": fields})
         url = f"{self.vault_url}/v1/vaults/{self.vault_id}/{table}"
-        headers = {
-            "Authorization": f"Bearer {self.bearer_token}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
         payload = {
-            "records": [{"fields": formatted_fields}],
+            "records": formatted_records,
             "tokenization": True,
             "quorum": False
         }
-        try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Skyflow Insert Record API Error: {e}")
-            raise Exception(f"Failed to insert record into Skyflow: {e}") from e
+        return url, orjson.dumps(payload)
     def detokenize(self, token: str) -> str:
         if token and str(token).startswith("mock_"):
             return self._mock_detokenize(token)
+        cached = self._detokenize_cache.get(token)
+        if cached is not None:
+            return cached
         try:
-            if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
-                raise ValueError("Skyflow Vault ID not configured")
-            if not self.bearer_token or self.bearer_token == "placeholder":
-                raise ValueError("Skyflow Bearer Token not configured")
-            target_field = None
-            skyflow_id_to_query = token
-            if "#" in token:
-                parts = token.split("#")
-                if len(parts) == 2:
-                    skyflow_id_to_query = parts[0]
-                    target_field = parts[1]
-            import re
-            uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-            is_uuid = re.match(uuid_pattern, skyflow_id_to_query.lower()) is not None
-            if is_uuid:
-                try:
-                    query_url = f"{self.vault_url}/v1/vaults/{self.vault_id}/persons"
-                    headers = {
-                        "Authorization": f"Bearer {self.bearer_token}",
-                        "Content-Type": "application/json"
-                    }
-                    query_params = {
-                        "skyflow_ids": skyflow_id_to_query,
-                        "redaction": "PLAIN_TEXT"
-                    }
-                    response = requests.get(query_url, params=query_params, headers=headers, timeout=30)
-                    if response.status_code == 200:
-                        result = response.json()
-                        if "records" in result and len(result["records"]) > 0:
-                            record = result["records"][0]
-                            fields = record.get("fields", {})
-                            if target_field:
-                                value = fields.get(target_field)
-                                if value:
-                                    return str(value)
-                            for field_name, field_value in fields.items():
-                                if field_value:
-                                    return str(field_value)
-                except Exception as query_err:
-                    print(f"⚠️ Query by skyflow_id failed: {query_err}")
-            url = f"{self.vault_url}/v1/vaults/{self.vault_id}/tokens/detokenize"
-            headers = {
-                "Authorization": f"Bearer {self.bearer_token}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "detokenizationParameters": [{"token": token}]
-            }
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-            if "records" in result and len(result["records"]) > 0:
-                return result["records"][0].get("value", "Unknown")
-            return "Unknown"
+            value = self._detokenize_remote(token)
+        except Exception as e:
+            logger.warning("Skyflow detokenization failed: %s", e)
+            return f"[{token[:8]}...]"
+        if value != "Unknown":
+            self._detokenize_cache.put(token, value)
+        return value
+    async def adetokenize(self, token: str) -> str:
+        if token and str(token).startswith("mock_"):
+            return self._mock_detokenize(token)
+        cached = self._detokenize_cache.get(token)
+        if cached is not None:
+            return cached
+        try:
+            value = await self._adetokenize_remote(token)
         except Exception as e:
-            print(f"⚠️ Skyflow detokenization failed: {e}")
-            if str(token).startswith("mock_"):
-                return self._mock_detokenize(token)
+            logger.warning("Skyflow detokenization failed: %s", e)
             return f"[{token[:8]}...]"
+        if value != "Unknown":
+            self._detokenize_cache.put(token, value)
+        return value
+    def clear_detokenize_cache(self):
+        self._detokenize_cache.clear()
+    def _detokenize_remote(self, token: str) -> str:
+        self._ensure_configured()
+        skyflow_id, target_field = _split_token(token)
+        if _looks_like_skyflow_id(skyflow_id):
+            try:
+                response = self._session.get(
+                    f"{self.vault_url}/v1/vaults/{self.vault_id}/persons",
+                    params={"skyflow_ids": skyflow_id, "redaction": "PLAIN_TEXT"},
+                    timeout=30
+                )
+                if response.status_code == 200:
+                    value = _record_value(orjson.loads(response.content), target_field)
+                    if value is not None:
+                        return value
+            except Exception as query_err:
+                logger.warning("Query by skyflow_id failed: %s", query_err)
+        url = f"{self.vault_url}/v1/vaults/{self.vault_id}/tokens/detokenize"
+        payload = {
+            "detokenizationParameters": [{"token": token}]
+        }
+        response = self._session.post(url, data=orjson.dumps(payload), timeout=30)
+        response.raise_for_status()
+        return _detokenized_value(orjson.loads(response.content))
+    async def _adetokenize_remote(self, token: str) -> str:
+        self._ensure_configured()
+        skyflow_id, target_field = _split_token(token)
+        if _looks_like_skyflow_id(skyflow_id):
+            try:
+                response = await self._aclient.get(
+                    f"{self.vault_url}/v1/vaults/{self.vault_id}/persons",
+                    params={"skyflow_ids": skyflow_id, "redaction": "PLAIN_TEXT"}
+                )
+                if response.status_code == 200:
+                    value = _record_value(orjson.loads(response.content), target_field)
+                    if value is not None:
+                        return value
+            except Exception as query_err:
+                logger.warning("Query by skyflow_id failed: %s", query_err)
+        url = f"{self.vault_url}/v1/vaults/{self.vault_id}/tokens/detokenize"
+        payload = {
+            "detokenizationParameters": [{"token": token}]
+        }
+        response = await self._aclient.post(url, content=orjson.dumps(payload))
+        response.raise_for_status()
+        return _detokenized_value(orjson.loads(response.content))
     def detect_pii(self, text: str) -> Dict[str, Any]:
-        print(f"DEBUG: detect_pii called with text length {len(text)}")
-        if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
-            print("DEBUG: Using mock detection (config)")
+        logger.debug("detect_pii called with text length %d", len(text))
+        if self._config_error:
+            logger.debug("Using mock detection (config)")
             return self._mock_detect_pii(text)
+        # Re-submitted documents (retries, re-renders) reuse the earlier vault tokens.
+        key = _detect_cache_key(text)
+        cached = self._detect_cache.get(key)
+        if cached is not None:
+            return _copy_detect_result(cached)
         try:
-            return self._real_detect_pii(text)
+            result = self._real_detect_pii(text)
         except Exception as e:
-            print(f"⚠️ PII Detection failed: {e}")
+            logger.warning("PII Detection failed: %s", e)
             return self._mock_detect_pii(text)
+        self._detect_cache.put(key, _copy_detect_result(result))
+        return result
+    async def adetect_pii(self, text: str) -> Dict[str, Any]:
+        # Same implementation as detect_pii, kept off the event loop while the vault calls run.
+        return await asyncio.to_thread(self.detect_pii, text)
     def _real_detect_pii(self, text: str) -> Dict[str, Any]:
-        # Placeholder for real implementation
-        raise NotImplementedError("Real PII detection not implemented yet")
+        entities = self._scan_pii(text)
+        if entities:
+            self._tokenize_entities(entities)
+        return self._build_detect_result(text, entities)
+    def _tokenize_entities(self, entities: List[_PIIEntity]):
+        # One bulk insert for every detected value instead of a round trip per entity.
+        columns, fields = _entity_fields(entities)
+        try:
+            records = self.insert_records("persons", fields).get("records", [])
+        except Exception as e:
+            status = _rejected_batch_status(e)
+            if status is None:
+                raise
+            # A single rejected value fails the whole batch, so retry each record on its own.
+            logger.warning("Bulk insert rejected (%s), inserting entities individually", status)
+            records = self._insert_records_concurrently("persons", fields)
+        self._apply_record_tokens(entities, columns, records)
+    def _apply_record_tokens(self, entities: List[_PIIEntity], columns: List[str], records: List[Optional[dict]]):
+        for index, (column, entity) in enumerate(zip(columns, entities)):
+            record = records[index] if index < len(records) else None
+            token = record.get("fields", {}).get(column) if record else None
+            if not token and record and record.get("skyflow_id"):
+                token = f"{record['skyflow_id']}#{column}"
+            if not token:
+                token = self._mock_tokenize(entity.value, entity.type.lower())
+            entity.token = token
+    def _insert_records_concurrently(self, table: str, records: List[dict]) -> List[Optional[dict]]:
+        def insert_one(fields):
+            try:
+                return self.insert_record(table, fields)["records"][0]
+            except Exception as e:
+                logger.warning("Skyflow insert failed for %s: %s", list(fields), e)
+                return None
+        with ThreadPoolExecutor(max_workers=min(16, len(records))) as executor:
+            return list(executor.map(insert_one, records))
     def _mock_detect_pii(self, text: str) -> Dict[str, Any]:
-        import re
+        entities = self._scan_pii(text)
+        for entity in entities:
+            entity.token = self._mock_tokenize(entity.value, entity.type.lower())
+        return self._build_detect_result(text, entities)
+    def _scan_pii(self, text: str) -> List[_PIIEntity]:
         entities = []
-        ssn_pattern = r'\b\d{3}-\d{2}-\d{4}\b'
-        for match in re.finditer(ssn_pattern, text):
-            val = match.group()
-            entities.append({
-                "type": "SSN",
-                "value": val,
-                "confidence": 0.99,
-                "start_pos": match.start(),
-                "end_pos": match.end(),
-                "token": self._mock_tokenize(val, "ssn")
-            })
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        for match in re.finditer(email_pattern, text):
-            val = match.group()
-            entities.append({
-                "type": "EMAIL",
-                "value": val,
-                "confidence": 0.99,
-                "start_pos": match.start(),
-                "end_pos": match.end(),
-                "token": self._mock_tokenize(val, "email")
-            })
-        dob_pattern = r'\b(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})\b'
-        for match in re.finditer(dob_pattern, text):
-            val = match.group()
-            entities.append({
-                "type": "DOB",
-                "value": val,
-                "confidence": 0.99,
-                "start_pos": match.start(),
-                "end_pos": match.end(),
-                "token": self._mock_tokenize(val, "dob")
-            })
-            
-        # Name detection (heuristics for mock data)
-        # Look for "Name: Value" or "Patient: Value" or "Patient Name: Value"
-        name_pattern = r'(?:Name|Patient|Patient Name):\s*([A-Za-z\s]+)(?:\n|$)'
-        for match in re.finditer(name_pattern, text, re.IGNORECASE):
-            val = match.group(1).strip()
-            if val and len(val) > 2 and "confidential" not in val.lower():
-                entities.append({
-                    "type": "NAME",
-                    "value": val,
-                    "confidence": 0.95,
-                    "start_pos": match.start(1),
-                    "end_pos": match.end(1),
-                    "token": self._mock_tokenize(val, "name")
-                })
-        redacted_text = text
-        for entity in sorted(entities, key=lambda x: x["start_pos"], reverse=True):
-            redacted_text = (
-                redacted_text[:entity["start_pos"]] + 
-                entity["token"] + 
-                redacted_text[entity["end_pos"]:]
-            )
+        for match in _PII_SCANNER.finditer(text):
+            entity_type = match.lastgroup
+            group = _PII_GROUPS[entity_type]
+            if entity_type == "NAME":
+                val = match.group(group).strip()
+                if not val or len(val) <= 2 or "confidential" in val.lower():
+                    continue
+                confidence = 0.95
+            else:
+                val = match.group()
+                confidence = 0.99
+            entities.append(_PIIEntity(entity_type, val, confidence, match.start(group), match.end(group)))
+        return entities
+    def _build_detect_result(self, text: str, entities: List[_PIIEntity]) -> Dict[str, Any]:
+        parts = []
+        cursor = 0
+        for entity in sorted(entities, key=lambda x: x.start_pos):
+            if entity.start_pos < cursor:
+                # Overlaps a span that was already replaced.
+                continue
+            parts.append(text[cursor:entity.start_pos])
+            parts.append(entity.token)
+            cursor = entity.end_pos
+        parts.append(text[cursor:])
+        redacted_text = "".join(parts)
         return {
-            "entities": entities,
+            "entities": [entity.to_dict() for entity in entities],
             "redacted_text": redacted_text,
             "total_entities_found": len(entities)
         }
@@ -251,56 +560,27 @@ class SkyflowService:
         Takes the result from detect_pii and returns a dictionary of tokens.
         """
         tokens = {}
-        entities = detect_result.get("entities", [])
-        
-        # Extract tokens for known types
-        for entity in entities:
-            entity_type = entity.get("type")
-            token = entity.get("token")
-            
-            if entity_type == "SSN":
-                tokens["ssn_token"] = token
-                tokens["ssn_confidence"] = entity.get("confidence", 0)
-            elif entity_type == "EMAIL":
-                tokens["email_token"] = token
-                tokens["email_confidence"] = entity.get("confidence", 0)
-            elif entity_type == "DOB":
-                tokens["dob_token"] = token
-                tokens["dob_confidence"] = entity.get("confidence", 0)
-            elif entity_type == "NAME":
-                tokens["name_token"] = token
-                tokens["name_confidence"] = entity.get("confidence", 0)
-                
+        for entity in detect_result.get("entities", []):
+            prefix = _TYPE_TO_PREFIX.get(entity.get("type"))
+            if prefix:
+                tokens[f"{prefix}_token"] = entity.get("token")
+                tokens[f"{prefix}_confidence"] = entity.get("confidence", 0)
         return tokens
-    def invoke_function(self, function_id: str, payload: dict):
+    async def ainvoke_function(self, function_id: str, payload: dict):
         try:
             if not function_id or function_id == "placeholder":
                 raise ValueError("Skyflow Function ID not configured")
-            if settings.SKYFLOW_VAULT_ID == "placeholder" or not self.vault_id:
-                raise ValueError("Skyflow Vault ID not configured")
-            if not self.bearer_token or self.bearer_token == "placeholder":
-                raise ValueError("Skyflow Bearer Token not configured")
+            self._ensure_configured()
             url = f"{self.vault_url}/v1/vaults/{self.vault_id}/functions/{function_id}"
-            headers = {
-                "Authorization": f"Bearer {self.bearer_token}",
-                "Content-Type": "application/json"
-            }
-            request_payload = {"body": payload}
-            print(f"Skyflow: Invoking function {function_id}...")
-            response = requests.post(url, json=request_payload, headers=headers, timeout=60)
+            body = orjson.dumps({"body": payload})
+            logger.debug("Skyflow: Invoking function %s...", function_id)
+            response = await self._aclient.post(url, content=body, timeout=60)
             if response.status_code == 404:
                 url = f"{self.vault_url}/v1/functions/{function_id}"
-                response = requests.post(url, json=request_payload, headers=headers, timeout=60)
+                response = await self._aclient.post(url, content=body, timeout=60)
             response.raise_for_status()
-            result = response.json()
-            if isinstance(result, dict):
-                if "result" in result:
-                    result = result["result"]
-                elif "body" in result:
-                    result = result["body"]
-            return result
+            return _function_result(orjson.loads(response.content))
         except Exception as e:
-            print(f"⚠️ Skyflow Function invocation failed: {e}")
-            print("🔄 Returning mock function response (failure handled by agent_service)...")
+            logger.warning("Skyflow Function invocation failed, returning failure response for agent_service fallback: %s", e)
             return {"success": False, "error": str(e)}
 skyflow_service = SkyflowService()
\ No newline at end of file
@@ -1,19 +1,37 @@
 import asyncio
 import sys
-import os
 import unittest
+from pathlib import Path
 from datetime import datetime
+from unittest import mock
+import httpx
+import requests
+from fastapi import HTTPException
 
 # Add project root to path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
+from backend.config import settings
+from backend.services.sanity_service import sanity_service
 from backend.services.skyflow_service import skyflow_service
 from backend.services.agent_service import agent_service
+from backend.api import patients as patients_api
 
 class TestVaultMindSystem(unittest.TestCase):
     
+    @classmethod
+    def setUpClass(cls):
+        # One loop for the whole class so the async Skyflow client is reused across tests
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(skyflow_service.aclose())
+        cls.loop.close()
+
     def setUp(self):
         print(f"\nStarting test: {self._testMethodName}")
+        skyflow_service.clear_detokenize_cache()
 
     def test_01_skyflow_mock_tokenization(self):
         """Test that Skyflow service falls back to mock tokenization."""
@@ -62,7 +80,7 @@ class TestVaultMindSystem(unittest.TestCase):
         print("Testing Agent Service Mock Fallback...")
         
         # Run async test
-        asyncio.run(self._async_test_agent_service())
+        self.loop.run_until_complete(self._async_test_agent_service())
 
     async def _async_test_agent_service(self):
         patient_id = "test-patient-verify"
@@ -154,5 +172,220 @@ class TestVaultMindSystem(unittest.TestCase):
         self.assertIsNone(tokens.get("name_token"))
         self.assertEqual(tokens.get("ssn_token"), "mock_ssn_456")
 
+    def test_08_real_detection_bulk_inserts_once(self):
+        """Test that real PII detection tokenizes every entity in one bulk insert."""
+        print("Testing Bulk Insert for Detected PII...")
+        text = "Patient Name: Jane Doe\nSSN: 123-45-6789\nEmail: jane@example.com"
+        
+        def fake_insert(table, records):
+            # Echo a token per column, but leave SSN without one to exercise the skyflow_id fallback
+            return {"records": [
+                {"skyflow_id": f"id-{i}", "fields": {col: f"tok_{col}" for col in fields if col != "ssn"}}
+                for i, fields in enumerate(records)
+            ]}
+        
+        with mock.patch.object(skyflow_service, "insert_records", side_effect=fake_insert) as insert:
+            result = skyflow_service._real_detect_pii(text)
+        
+        self.assertEqual(insert.call_count, 1)
+        self.assertEqual(len(insert.call_args[0][1]), 3)
+        tokens = {e["type"]: e["token"] for e in result["entities"]}
+        print(f"Tokens: {tokens}")
+        
+        self.assertEqual(tokens["NAME"], "tok_name")
+        self.assertEqual(tokens["EMAIL"], "tok_email_address")
+        self.assertTrue(tokens["SSN"].endswith("#ssn"))
+        self.assertNotIn("123-45-6789", result["redacted_text"])
+    def test_09_rejected_bulk_insert_falls_back_per_entity(self):
+        """Test that a rejected bulk insert is retried one entity at a time."""
+        print("Testing Per-Entity Insert Fallback...")
+        text = "SSN: 123-45-6789\nEmail: jane@example.com"
+        rejected = Exception("Failed to insert record into Skyflow: 400")
+        rejected.__cause__ = requests.exceptions.HTTPError(response=mock.Mock(status_code=400))
+        
+        def fake_insert(table, records):
+            if len(records) > 1:
+                raise rejected
+            column = next(iter(records[0]))
+            if column == "ssn":
+                raise Exception("invalid ssn")
+            return {"records": [{"skyflow_id": "id-1", "fields": {column: f"tok_{column}"}}]}
+        
+        with mock.patch.object(skyflow_service, "insert_records", side_effect=fake_insert) as insert:
+            result = skyflow_service._real_detect_pii(text)
+        
+        self.assertEqual(insert.call_count, 3)
+        tokens = {e["type"]: e["token"] for e in result["entities"]}
+        print(f"Tokens: {tokens}")
+        
+        self.assertEqual(tokens["EMAIL"], "tok_email_address")
+        self.assertTrue(tokens["SSN"].startswith("mock_ssn_"))
+    def test_10_detokenize_cache(self):
+        """Test that repeated detokenization of a vault token is served from cache."""
+        print("Testing Detokenize Cache...")
+        token = "1b3f8a7e-2c4d-4e5f-9a0b-1c2d3e4f5a6b#name"
+        with mock.patch.object(skyflow_service, "_detokenize_remote", return_value="Jane Doe") as remote:
+            first = skyflow_service.detokenize(token)
+            second = skyflow_service.detokenize(token)
+        
+        self.assertEqual(first, "Jane Doe")
+        self.assertEqual(second, "Jane Doe")
+        self.assertEqual(remote.call_count, 1)
+    def test_11_async_detection_bulk_inserts_once(self):
+        """Test that async PII detection goes through the same single bulk insert."""
+        print("Testing Async Bulk Insert for Detected PII...")
+        text = "SSN: 123-45-6789\nEmail: jane@example.com"
+        
+        text = f"{text}\nRef: {datetime.now().isoformat()}"
+        
+        def fake_insert(table, records):
+            return {"records": [
+                {"skyflow_id": f"id-{i}", "fields": {col: f"tok_{col}" for col in fields}}
+                for i, fields in enumerate(records)
+            ]}
+        
+        with mock.patch.object(skyflow_service, "_config_error", None), \
+                mock.patch.object(skyflow_service, "insert_records", side_effect=fake_insert) as insert:
+            result = self.loop.run_until_complete(skyflow_service.adetect_pii(text))
+        
+        self.assertEqual(insert.call_count, 1)
+        tokens = {e["type"]: e["token"] for e in result["entities"]}
+        print(f"Tokens: {tokens}")
+        
+        self.assertEqual(tokens["SSN"], "tok_ssn")
+        self.assertEqual(tokens["EMAIL"], "tok_email_address")
+        self.assertNotIn("jane@example.com", result["redacted_text"])
+    def test_12_no_pii_skips_vault(self):
+        """Test that text without PII never reaches the vault."""
+        print("Testing No-PII Short Circuit...")
+        text = "SELECT department, COUNT(*) FROM visits GROUP BY department"
+        with mock.patch.object(skyflow_service, "insert_records") as insert:
+            result = skyflow_service._real_detect_pii(text)
+        
+        insert.assert_not_called()
+        self.assertEqual(result["total_entities_found"], 0)
+        self.assertEqual(result["redacted_text"], text)
+    def test_13_detect_cache(self):
+        """Test that re-submitting the same document reuses the earlier detection."""
+        print("Testing Detection Cache...")
+        text = f"SSN: 987-65-4321 ({datetime.now().isoformat()})"
+        entity = {"type": "SSN", "value": "987-65-4321", "token": "tok_ssn", "confidence": 0.99}
+        expected = dict(entity)
+        detected = {"entities": [entity], "redacted_text": text, "total_entities_found": 1}
+        with mock.patch.object(skyflow_service, "_config_error", None), \
+                mock.patch.object(skyflow_service, "_real_detect_pii", return_value=detected) as real:
+            first = skyflow_service.detect_pii(text)
+            first["entities"][0]["token"] = "edited"
+            first["entities"].pop()
+            second = skyflow_service.detect_pii(text)
+        
+        self.assertEqual(real.call_count, 1)
+        # Edits to a returned result must not leak into later cache hits
+        self.assertEqual(second["entities"], [expected])
+        self.assertEqual(second["redacted_text"], text)
+    def test_14_tokenize_many_single_round_trip(self):
+        """Test that batch tokenization sends every patient in one vault insert."""
+        print("Testing Batch Tokenization...")
+        items = [
+            {"name": "Jane Doe", "ssn": "123-45-6789"},
+            {"condition": "Asthma"},
+            {"name": "John Roe", "dob": "01/02/1980"}
+        ]
+        
+        def fake_insert(table, records):
+            return {"records": [
+                {"skyflow_id": f"id-{i}", "fields": {col: f"tok{i}_{col}" for col in fields}}
+                for i, fields in enumerate(records)
+            ]}
+        
+        with mock.patch.object(skyflow_service, "insert_records", side_effect=fake_insert) as insert:
+            results = skyflow_service.tokenize_many(items)
+        
+        self.assertEqual(insert.call_count, 1)
+        self.assertEqual(len(insert.call_args[0][1]), 2)
+        self.assertEqual(results[0], {"name_token": "tok0_name", "ssn_token": "tok0_ssn"})
+        self.assertEqual(results[1], {"condition": "Asthma"})
+        self.assertEqual(results[2], {"name_token": "tok1_name", "dob_token": "tok1_date_of_birth"})
+
+    def test_15_create_patients_single_mutation(self):
+        """Test that batch patient creation sends one Sanity mutate request."""
+        print("Testing Batch Sanity Create...")
+        docs = [{"name_token": "tok_a"}, {"name_token": "tok_b"}]
+        response = mock.Mock(content=b'{"results": [{"id": "doc-a"}, {"id": "doc-b"}]}')
+        client = mock.Mock()
+        client.post.return_value = response
+        
+        with mock.patch.object(settings, "SANITY_PROJECT_ID", "proj"), \
+                mock.patch.object(sanity_service, "project_id", "proj"), \
+                mock.patch.object(sanity_service, "token", "secret"), \
+                mock.patch.object(sanity_service, "_client_instance", client):
+            created = sanity_service.create_patients(docs)
+        
+        self.assertEqual(client.post.call_count, 1)
+        client.get.assert_not_called()
+        self.assertEqual([c["id"] for c in created], ["doc-a", "doc-b"])
+        self.assertEqual(created[1]["name_token"], "tok_b")
+
+    def test_16_batch_create_fallback_only_on_rejection(self):
+        """Test that per-patient creates only follow a mutate Sanity rejected."""
+        print("Testing Batch Sanity Create Fallback...")
+        docs = [{"name_token": "tok_a"}, {"name_token": "tok_b"}]
+        request = httpx.Request("POST", "https://example.api.sanity.io/mutate")
+        rejected = httpx.HTTPStatusError("rejected", request=request, response=httpx.Response(400, request=request))
+        
+        # Failure after the mutate committed: must not create the patients a second time
+        with mock.patch.object(sanity_service, "create_patients", side_effect=RuntimeError("ids unresolved")), \
+                mock.patch.object(sanity_service, "create_patient") as create_one:
+            with self.assertRaises(HTTPException):
+                patients_api._create_patients(docs)
+        create_one.assert_not_called()
+        
+        with mock.patch.object(sanity_service, "create_patients", side_effect=rejected), \
+                mock.patch.object(sanity_service, "create_patient", side_effect=lambda doc: {"id": doc["name_token"]}) as create_one:
+            results = patients_api._create_patients(docs)
+        self.assertEqual(create_one.call_count, 2)
+        self.assertEqual([r["id"] for r in results], ["tok_a", "tok_b"])
+        
+        # Nothing sent (Sanity not configured): every row fails on its own, no retries
+        with mock.patch.object(sanity_service, "create_patients", side_effect=ValueError("not configured")), \
+                mock.patch.object(sanity_service, "create_patient") as create_one:
+            results = patients_api._create_patients(docs)
+        create_one.assert_not_called()
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(patients_api._create_patients([]), [])
+
+    def test_17_tokenize_many_failure_skips_per_item_retries(self):
+        """Test that a non-rejection bulk failure mock-tokenizes instead of retrying each item."""
+        print("Testing Batch Tokenization Failure...")
+        items = [{"name": "Jane Doe"}, {"ssn": "123-45-6789", "condition": "Asthma"}]
+        
+        with mock.patch.object(skyflow_service, "insert_records", side_effect=Exception("vault unreachable")) as insert, \
+                mock.patch.object(skyflow_service, "tokenize") as tokenize:
+            results = skyflow_service.tokenize_many(items)
+        
+        self.assertEqual(insert.call_count, 1)
+        tokenize.assert_not_called()
+        self.assertTrue(results[0]["name_token"].startswith("mock_name_"))
+        self.assertEqual(results[1]["condition"], "Asthma")
+        self.assertTrue(results[1]["ssn_token"].startswith("mock_ssn_"))
+
+    def test_18_refresh_token_clears_detokenize_cache(self):
+        """Test that rotating the bearer token drops cached plaintext."""
+        print("Testing Detokenize Cache Invalidation On Token Refresh...")
+        token = "2c4e9b8f-3d5e-4f6a-8b1c-2d3e4f5a6b7c#name"
+        original = skyflow_service.bearer_token
+        try:
+            with mock.patch.object(skyflow_service, "_detokenize_remote", return_value="Jane Doe") as remote:
+                skyflow_service.detokenize(token)
+                skyflow_service.refresh_token(original)
+                skyflow_service.detokenize(token)
+                self.assertEqual(remote.call_count, 1)
+                skyflow_service.refresh_token("rotated-bearer-token")
+                skyflow_service.detokenize(token)
+                self.assertEqual(remote.call_count, 2)
+        finally:
+            skyflow_service.refresh_token(original)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,17 +1,55 @@
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown
 from ..config import settings
 from ..services.agent_service import agent_service
+from ..services.skyflow_service import skyflow_service
 import asyncio
+import os
+import threading
 celery_app = Celery(
     "worker",
     broker=settings.REDIS_URL,
     backend=settings.REDIS_URL
 )
+# One loop per worker process, so the async HTTP clients (and their
+# keep-alive connections) survive from one task to the next.
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="celery-asyncio", daemon=True)
+            _loop_thread.start()
+        return _loop
+def _reset_loop():
+    # The loop thread does not survive a fork; the child starts its own.
+    global _loop, _loop_thread, _loop_lock
+    _loop_lock = threading.Lock()
+    _loop = None
+    _loop_thread = None
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_loop)
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _stop_loop(**kwargs):
+    global _loop, _loop_thread
+    with _loop_lock:
+        loop, thread = _loop, _loop_thread
+        _loop = _loop_thread = None
+    if loop is None or loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(skyflow_service.aclose(), loop).result(timeout=5)
+    except Exception as e:
+        print(f"Warning: Could not close Skyflow client: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    if not loop.is_running():
+        loop.close()
 @celery_app.task(name="process_patient_task")
 def process_patient_task(patient_id: str, patient_data: dict):
-    loop = asyncio.get_event_loop()
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(agent_service.process_patient(patient_id, patient_data))
-    return result
\ No newline at end of file
+    future = asyncio.run_coroutine_threadsafe(agent_service.process_patient(patient_id, patient_data), _get_loop())
+    return future.result()
@@ -3,70 +3,59 @@
 Check if Skyflow bearer token is expired and regenerate if needed
 """
 
-import os
+import base64
 import sys
-import json
 import time
-import jwt
-import requests
+import orjson
 from pathlib import Path
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from skyflow_auth import exchange_jwt, load_signing_key
+from env_utils import ENV_PATH, env_settings, update_env_value
+from generate_skyflow_token import load_cached_token, load_credentials, save_cached_token
+from datetime import timedelta
 
-def check_token_expiry(token):
-    """Check if token is expired or expires soon (within 5 minutes)"""
-    try:
-        decoded = jwt.decode(token, options={'verify_signature': False})
-        exp = decoded.get('exp', 0)
-        if exp:
-            exp_time = datetime.fromtimestamp(exp)
-            now = datetime.now()
-            time_until_expiry = exp_time - now
-            
-            # Check if expired or expires within 5 minutes
-            if time_until_expiry <= timedelta(minutes=5):
-                return True, time_until_expiry
-            return False, time_until_expiry
-        return True, None  # No expiration found, assume expired
-    except Exception as e:
-        # If we can't decode, assume expired
-        return True, None
+_HERE = Path(__file__).parent
 
-def exchange_jwt_for_access_token(signed_jwt, token_uri, client_id=None):
-    """Exchange JWT for OAuth access token"""
+def _exp_from_jwt(token):
+    """Read the exp claim straight from the payload segment (no header/signature handling)"""
     try:
-        data = {
-            "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
-            "assertion": signed_jwt
-        }
-        if client_id:
-            data["client_id"] = client_id
-        
-        response = requests.post(
-            token_uri,
-            data=data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get("accessToken") or result.get("access_token")
+        payload = token.split('.', 2)[1]
+        exp = orjson.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))).get('exp')
+    except (IndexError, ValueError, AttributeError, TypeError):
         return None
-    except Exception:
+    # A missing or non-numeric exp is treated like an undecodable token (expired)
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)):
         return None
+    return exp
+
+def check_token_expiry(token):
+    """Check if token is expired or expires soon (within 5 minutes)"""
+    exp = _exp_from_jwt(token)
+    if not exp:
+        return True, None  # No expiration found (or undecodable), assume expired
+    remaining = exp - time.time()
+    try:
+        time_until_expiry = timedelta(seconds=remaining)
+    except OverflowError:
+        return True, None  # Out-of-range exp, assume expired like an undecodable token
+    # Check if expired or expires within 5 minutes
+    return remaining <= 300, time_until_expiry
 
 def generate_new_token(credentials_path="credentials.json"):
     """Generate a new bearer token from credentials"""
     try:
-        with open(credentials_path, 'r') as f:
-            credentials = json.load(f)
+        credentials = load_credentials(credentials_path)
         
         private_key = credentials['privateKey']
         key_id = credentials['keyID']
         token_uri = credentials['tokenURI']
         client_id = credentials.get('clientID')
         
+        cached_token = load_cached_token(key_id)
+        if cached_token:
+            return cached_token
+        
+        import jwt
+        
         # Use clientID as issuer (Skyflow service accounts use clientID)
         issuer = client_id if client_id else key_id
         
@@ -80,14 +69,15 @@ def generate_new_token(credentials_path="credentials.json"):
         
         signed_jwt = jwt.encode(
             claims,
-            private_key,
+            load_signing_key(private_key),
             algorithm='RS256',
             headers={"kid": key_id}
         )
         
         # Exchange JWT for OAuth access token
-        oauth_token = exchange_jwt_for_access_token(signed_jwt, token_uri, client_id)
+        oauth_token, exp = exchange_jwt(signed_jwt, token_uri, client_id)
         if oauth_token:
+            save_cached_token(oauth_token, key_id, exp)
             return oauth_token
         
         # Fallback to JWT if OAuth exchange fails
@@ -96,40 +86,10 @@ def generate_new_token(credentials_path="credentials.json"):
         print(f"Error generating token: {e}", file=sys.stderr)
         return None
 
-def update_env_file(env_path, new_token):
-    """Update SKYFLOW_BEARER_TOKEN in .env file"""
-    try:
-        # Read current .env
-        lines = []
-        token_updated = False
-        
-        if env_path.exists():
-            with open(env_path, 'r') as f:
-                for line in f:
-                    if line.strip().startswith('SKYFLOW_BEARER_TOKEN='):
-                        lines.append(f'SKYFLOW_BEARER_TOKEN={new_token}\n')
-                        token_updated = True
-                    else:
-                        lines.append(line)
-        
-        # If token line not found, add it
-        if not token_updated:
-            lines.append(f'SKYFLOW_BEARER_TOKEN={new_token}\n')
-        
-        # Write back
-        with open(env_path, 'w') as f:
-            f.writelines(lines)
-        
-        return True
-    except Exception as e:
-        print(f"Error updating .env: {e}", file=sys.stderr)
-        return False
-
 def main():
-    # Find .env file
-    script_dir = Path(__file__).parent
-    env_path = script_dir / ".env"
-    credentials_path = script_dir / "credentials.json"
+    # .env and credentials.json live next to the scripts
+    env_path = ENV_PATH
+    credentials_path = _HERE / "credentials.json"
     
     if not env_path.exists():
         print("⚠️  .env file not found, skipping token check", file=sys.stderr)
@@ -140,14 +100,13 @@ def main():
         return 0
     
     # Load current token
-    load_dotenv(env_path)
-    current_token = os.getenv("SKYFLOW_BEARER_TOKEN", "").strip()
+    current_token = env_settings().bearer_token
     
     if not current_token or current_token == "placeholder":
         print("ℹ️  SKYFLOW_BEARER_TOKEN not set, generating new token...")
         new_token = generate_new_token(credentials_path)
         if new_token:
-            if update_env_file(env_path, new_token):
+            if update_env_value(env_path, "SKYFLOW_BEARER_TOKEN", new_token):
                 print("✅ Generated and saved new Skyflow bearer token")
                 return 0
             else:
@@ -168,8 +127,10 @@ def main():
             print(f"⚠️  Skyflow bearer token expired, regenerating...")
         new_token = generate_new_token(credentials_path)
         if new_token:
-            if update_env_file(env_path, new_token):
-                print("✅ Regenerated and saved new Skyflow bearer token (valid for 60 minutes)")
+            if update_env_value(env_path, "SKYFLOW_BEARER_TOKEN", new_token):
+                exp = _exp_from_jwt(new_token)
+                lifetime = f" (valid for {max(0, round((exp - time.time()) / 60))} minutes)" if exp else ""
+                print(f"✅ Regenerated and saved new Skyflow bearer token{lifetime}")
                 return 0
             else:
                 print("❌ Failed to update .env file", file=sys.stderr)
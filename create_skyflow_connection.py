@@ -3,18 +3,16 @@
 Create a Skyflow Connection to invoke the secure-ai-analysis function
 """
 
-import requests
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import orjson
+from http_client import client
+from env_utils import env_settings
 
 # Configuration
 VAULT_ID = "a66c8e2f5fac40dd929723f20f49fd33"
 ACCOUNT_ID = "u81740d3215e4583b26581dd83583fa6"
 WORKSPACE_ID = "d214744a8e444106929ff522adb4cb9e"
 FUNCTION_DEPLOYMENT_ID = "dbaa945fd78449c9a261d513d1d3a413"
-BEARER_TOKEN = os.getenv("SKYFLOW_BEARER_TOKEN")
+BEARER_TOKEN = env_settings().bearer_token
 
 # Management API endpoint
 MANAGEMENT_API_URL = "https://manage.skyflowapis-preview.com/v1"
@@ -51,12 +49,12 @@ def create_function_connection():
     print(f"Config: {connection_config}")
     
     try:
-        response = requests.post(url, json=connection_config, headers=headers)
+        response = client.post(url, content=orjson.dumps(connection_config), headers=headers)
         print(f"\nResponse Status: {response.status_code}")
         print(f"Response Body: {response.text}")
         
         if response.status_code in [200, 201]:
-            result = response.json()
+            result = orjson.loads(response.content)
             connection_id = result.get("connectionID") or result.get("id")
             
             if connection_id:
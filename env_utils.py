@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Shared .env helpers for the Skyflow helper scripts
+
+Rewrites the file in one read and one atomic write so a crash mid-update
+never leaves a truncated .env behind.
+"""
+
+import os
+import re
+import sys
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+
+ENV_PATH = Path(__file__).parent / ".env"
+
+@lru_cache(maxsize=1)
+def env_settings():
+    """Parse .env once per process and return the values the scripts need"""
+    # load_dotenv never overrides the process environment, so skip parsing when it is already set
+    if "SKYFLOW_BEARER_TOKEN" not in os.environ:
+        from dotenv import load_dotenv
+        load_dotenv(ENV_PATH)
+    return SimpleNamespace(
+        bearer_token=os.environ.get("SKYFLOW_BEARER_TOKEN", "").strip(),
+    )
+
+def atomic_write(path, data, mode=None):
+    """Write bytes to a sibling temp file, fsync it and rename it over path"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    if mode is None:
+        mode = path.stat().st_mode & 0o777 if path.exists() else 0o644
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+@lru_cache(maxsize=None)
+def _key_pattern(key):
+    return re.compile(rf"^[ \t]*{re.escape(key)}=.*$", re.M)
+
+def update_env_value(env_path, key, value):
+    """Set key=value in the .env file, replacing existing entries or appending one"""
+    try:
+        text = env_path.read_text() if env_path.exists() else ""
+        line = f"{key}={value}"
+        new_text, replaced = _key_pattern(key).subn(lambda _: line, text)
+        if not replaced:
+            new_text = f"{text.rstrip()}\n{line}\n" if text.strip() else f"{line}\n"
+        atomic_write(env_path, new_text.encode())
+        return True
+    except Exception as e:
+        print(f"Error updating .env: {e}", file=sys.stderr)
+        return False
@@ -6,67 +6,63 @@ This script generates a JWT and exchanges it for an OAuth access token
 that can be used for Skyflow Vault API authentication.
 """
 
-import json
+import os
+from functools import lru_cache
 import time
-import jwt
-import requests
+import orjson
 from pathlib import Path
+from env_utils import atomic_write
+from skyflow_auth import exchange_jwt, load_signing_key
 
-def exchange_jwt_for_access_token(signed_jwt, token_uri, client_id=None):
-    """Exchange JWT for OAuth access token using Skyflow's OAuth flow"""
+# Access tokens are reused across runs until they are this close to expiring
+TOKEN_CACHE_PATH = Path("~/.skyflow_token_cache.json").expanduser()
+TOKEN_CACHE_MIN_TTL = 300
+
+def load_cached_entry(key_id, cache_path=TOKEN_CACHE_PATH):
+    """Return (token, exp) for key_id if the cached token is valid for at least 5 more minutes"""
     try:
-        print("Exchanging JWT for OAuth access token...")
-        
-        # Skyflow OAuth uses urn:ietf:params:oauth:grant-type:jwt-bearer grant type
-        data = {
-            "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
-            "assertion": signed_jwt
-        }
-        
-        # Some implementations might need client_id
-        if client_id:
-            data["client_id"] = client_id
-        
-        response = requests.post(
-            token_uri,
-            data=data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            # Skyflow uses 'accessToken' (camelCase), also check 'access_token' for compatibility
-            access_token = result.get("accessToken") or result.get("access_token")
-            if access_token:
-                print("✅ Successfully obtained OAuth access token")
-                expires_in = result.get("expiresIn") or result.get("expires_in", 3600)
-                print(f"   Token expires in: {expires_in} seconds ({expires_in/60:.1f} minutes)")
-                print(f"   Token type: {result.get('tokenType', 'Bearer')}")
-                return access_token
-            else:
-                print(f"⚠️  No accessToken in response: {result}")
-                return signed_jwt
-        else:
-            error_text = response.text[:500]
-            print(f"⚠️  OAuth exchange failed (status {response.status_code}): {error_text}")
-            # Try alternative method
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️  Failed to exchange JWT for OAuth token: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"   Response: {e.response.text[:500]}")
-        return None
-    except Exception as e:
-        print(f"⚠️  Unexpected error during OAuth exchange: {e}")
-        return None
+        cached = orjson.loads(cache_path.read_bytes())
+    except (OSError, ValueError):
+        return None, None
+    exp = cached.get("exp")
+    if cached.get("key") != key_id or not isinstance(exp, (int, float)) or exp - time.time() <= TOKEN_CACHE_MIN_TTL:
+        return None, None
+    return cached.get("token"), exp
+
+def load_cached_token(key_id, cache_path=TOKEN_CACHE_PATH):
+    """Return the cached access token for key_id if it is valid for at least 5 more minutes"""
+    return load_cached_entry(key_id, cache_path)[0]
+
+def save_cached_token(token, key_id, exp=None, cache_path=TOKEN_CACHE_PATH):
+    """Persist an access token with its expiry (owner-only permissions)"""
+    if exp is None:
+        import jwt
+        try:
+            exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.PyJWTError:
+            return
+    if not exp:
+        return
+    try:
+        atomic_write(cache_path, orjson.dumps({"token": token, "exp": exp, "key": key_id}), 0o600)
+    except OSError as e:
+        print(f"⚠️  Could not write token cache: {e}")
 
-def generate_bearer_token(credentials_path="credentials.json", exchange=True):
-    """Generate a bearer token from Skyflow credentials."""
+@lru_cache(maxsize=4)
+def _read_credentials(path, mtime_ns):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def load_credentials(credentials_path="credentials.json"):
+    """Parse credentials.json once per process (re-read if the file changes)"""
+    path = os.path.abspath(credentials_path)
+    return _read_credentials(path, os.stat(path).st_mtime_ns)
+
+def generate_bearer_token(credentials_path="credentials.json", exchange=True, use_cache=True):
+    """Generate a bearer token from Skyflow credentials (use_cache=False forces a fresh exchange)."""
     
     # Load credentials
-    with open(credentials_path, 'r') as f:
-        credentials = json.load(f)
+    credentials = load_credentials(credentials_path)
     
     # Extract required fields
     private_key = credentials['privateKey']
@@ -80,6 +76,15 @@ def generate_bearer_token(credentials_path="credentials.json", exchange=True):
     
     print(f"Using issuer: {issuer} (from clientID: {client_id or 'N/A'}, keyID: {key_id})")
     
+    if exchange and use_cache:
+        cached_token, cached_exp = load_cached_entry(key_id)
+        if cached_token:
+            print("✅ Reusing cached OAuth access token (skipping JWT signing and exchange)")
+            _print_token(cached_token, cached_exp)
+            return cached_token
+    
+    import jwt
+    
     # Create JWT claims
     # According to Skyflow docs, issuer should typically be the clientID
     claims = {
@@ -93,39 +98,53 @@ def generate_bearer_token(credentials_path="credentials.json", exchange=True):
     # Generate signed JWT
     signed_jwt = jwt.encode(
         claims,
-        private_key,
+        load_signing_key(private_key),
         algorithm='RS256',
         headers={"kid": key_id}
     )
     
     # Exchange JWT for OAuth access token if requested
     bearer_token = signed_jwt
+    bearer_exp = claims["exp"]
     if exchange:
-        oauth_token = exchange_jwt_for_access_token(signed_jwt, token_uri, client_id)
+        print("Exchanging JWT for OAuth access token...")
+        oauth_token, exp = exchange_jwt(signed_jwt, token_uri, client_id)
         if oauth_token and oauth_token != signed_jwt:
             bearer_token = oauth_token
+            bearer_exp = exp
+            save_cached_token(oauth_token, key_id, exp)
+            print(f"✅ Successfully obtained OAuth access token (expires in {(exp - time.time()) / 60:.1f} minutes)")
             print("\n✅ Using OAuth access token (recommended for vault API calls)")
         else:
-            print("\n⚠️  OAuth exchange failed or returned JWT. The JWT token may still work for vault API calls.")
-            print("   If you continue to get 401 errors, check:")
-            print("   1. Service account permissions in Skyflow Studio")
-            print("   2. Vault access permissions")
-            print("   3. Credentials are from the correct environment (preview vs production)")
+            print(
+                "\n⚠️  OAuth exchange failed or returned JWT. The JWT token may still work for vault API calls.\n"
+                "   If you continue to get 401 errors, check:\n"
+                "   1. Service account permissions in Skyflow Studio\n"
+                "   2. Vault access permissions\n"
+                "   3. Credentials are from the correct environment (preview vs production)"
+            )
     
-    print("\n" + "=" * 80)
-    print("SKYFLOW BEARER TOKEN GENERATED")
-    print("=" * 80)
-    print("\nYour bearer token (valid for 60 minutes):")
-    print("-" * 80)
-    print(bearer_token)
-    print("-" * 80)
-    print("\n✅ Copy the token above and add it to your .env file as:")
-    print("   SKYFLOW_BEARER_TOKEN=<paste_token_here>")
-    print("\n⚠️  Note: This token expires in 60 minutes. Re-run this script to generate a new one.")
-    print("=" * 80)
+    _print_token(bearer_token, bearer_exp)
     
     return bearer_token
 
+def _print_token(bearer_token, exp):
+    minutes = max(0, round((exp - time.time()) / 60))
+    # One write for the whole banner instead of a flush per line
+    print("\n".join([
+        "\n" + "=" * 80,
+        "SKYFLOW BEARER TOKEN GENERATED",
+        "=" * 80,
+        f"\nYour bearer token (valid for {minutes} minutes):",
+        "-" * 80,
+        bearer_token,
+        "-" * 80,
+        "\n✅ Copy the token above and add it to your .env file as:",
+        "   SKYFLOW_BEARER_TOKEN=<paste_token_here>",
+        f"\n⚠️  Note: This token expires in {minutes} minutes. Re-run this script to generate a new one.",
+        "=" * 80,
+    ]))
+
 if __name__ == "__main__":
     try:
         token = generate_bearer_token()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for the Skyflow helper scripts
+
+One HTTP/2 client per process, so calls to the same Skyflow host
+multiplex over a single pooled TLS connection.
+"""
+
+import time
+import httpx
+
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+class _RetryTransport(httpx.HTTPTransport):
+    """Retry dropped keepalive connections and gateway errors with exponential backoff"""
+
+    def __init__(self, *args, max_retries=3, backoff_factor=0.2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+
+    def handle_request(self, request):
+        for attempt in range(self._max_retries + 1):
+            try:
+                response = super().handle_request(request)
+            except (httpx.RemoteProtocolError, httpx.ReadError):
+                if attempt == self._max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self._max_retries:
+                    return response
+                response.close()
+            time.sleep(self._backoff_factor * (2 ** attempt))
+
+client = httpx.Client(
+    http2=True,
+    timeout=30.0,
+    transport=_RetryTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    ),
+    headers={"User-Agent": "vaultmind/1.0"}
+)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Skyflow OAuth helpers shared by the token scripts
+
+Loads the service-account signing key and exchanges a signed JWT
+for a vault access token.
+"""
+
+import sys
+import time
+from functools import lru_cache
+import orjson
+
+JWT_BEARER_GRANT = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+_FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+@lru_cache(maxsize=4)
+def load_signing_key(private_key_pem):
+    """Parse the service-account PEM once so repeated RS256 signs skip key loading"""
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    return load_pem_private_key(private_key_pem.encode(), password=None)
+
+def exchange_jwt(signed_jwt, token_uri, client_id=None, client=None):
+    """Exchange a signed JWT for an OAuth access token, returning (token, exp_epoch)"""
+    # Imported here so a cached-token run never pays for httpx/TLS setup
+    import httpx
+    if client is None:
+        from http_client import client
+    data = {"grant_type": JWT_BEARER_GRANT, "assertion": signed_jwt}
+    if client_id:
+        data["client_id"] = client_id
+    try:
+        response = client.post(
+            token_uri,
+            data=data,
+            headers=_FORM_HEADERS,
+            timeout=30
+        )
+    except httpx.HTTPError as e:
+        print(f"⚠️  OAuth exchange request failed: {e}", file=sys.stderr)
+        return None, None
+    if response.status_code != 200:
+        print(f"⚠️  OAuth exchange failed (status {response.status_code}): {response.text[:500]}", file=sys.stderr)
+        return None, None
+    try:
+        body = orjson.loads(response.content)
+        # Skyflow uses camelCase; snake_case is accepted for compatibility
+        token = body.get("accessToken") or body.get("access_token")
+        expires_in = int(body.get("expiresIn") or body.get("expires_in") or 3600)
+    except (orjson.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        print(f"⚠️  Unexpected OAuth exchange response: {e}", file=sys.stderr)
+        return None, None
+    if not token:
+        print("⚠️  No accessToken in OAuth exchange response", file=sys.stderr)
+        return None, None
+    return token, int(time.time()) + expires_in